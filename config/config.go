@@ -76,7 +76,15 @@ type Repository struct {
 	Master      string
 }
 
-func FindRepository(module string) (*Repository, error) {
+// repositories indexes the entries of repositories.yaml by name once the file has
+// been loaded. The file does not change while nnf-deploy runs, so it is only read and
+// parsed once.
+var repositories map[string]*Repository
+
+func loadRepositories() (map[string]*Repository, error) {
+	if repositories != nil {
+		return repositories, nil
+	}
 
 	configFile, err := os.ReadFile("config/repositories.yaml")
 	if err != nil {
@@ -91,12 +99,28 @@ func FindRepository(module string) (*Repository, error) {
 		return nil, err
 	}
 
-	for _, repository := range config.Repositories {
-		if module == repository.Name {
-			return &repository, nil
+	repositories = make(map[string]*Repository, len(config.Repositories))
+	for i := range config.Repositories {
+		repository := &config.Repositories[i]
+		if _, found := repositories[repository.Name]; !found {
+			repositories[repository.Name] = repository
 		}
 	}
 
+	return repositories, nil
+}
+
+func FindRepository(module string) (*Repository, error) {
+
+	repos, err := loadRepositories()
+	if err != nil {
+		return nil, err
+	}
+
+	if repository, found := repos[module]; found {
+		return repository, nil
+	}
+
 	return nil, fmt.Errorf("Repository '%s' Not Found", module)
 }
 
@@ -25,39 +25,48 @@ source common.sh
 
 CMD="$1"
 
+# Fetch the node names once so each system below can classify them locally.
+get_all_nodes() {
+    ALL_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name)
+}
+
 case "$CMD" in
 dp0)
+    get_all_nodes
     # The following commands apply to initializing the current DP0 environment
     # Nodes containing 'cn' are considered to be worker nodes for the time being.
-    COMPUTE_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep cn | paste -d" " -s -)
-    RABBIT_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -v cn | grep -v master | paste -d" " -s -)
-    MASTER_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep master | paste -d" " -s -)
+    COMPUTE_NODES=$(echo "$ALL_NODES" | grep cn | paste -d" " -s -)
+    RABBIT_NODES=$(echo "$ALL_NODES" | grep -v cn | grep -v master | paste -d" " -s -)
+    MASTER_NODES=$(echo "$ALL_NODES" | grep master | paste -d" " -s -)
 
     # We are using COMPUTE_NODES as generic k8s workers.
     WORKER_NODES="$COMPUTE_NODES"
     ;;
 
 dp1)
+    get_all_nodes
     # The following commands apply to initializing the current DP1 environment
-    WORKER_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'worker' | paste -d" " -s -)
-    RABBIT_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'node'   | grep -v master | paste -d" " -s -)
-    MASTER_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'master' | paste -d" " -s -)
+    WORKER_NODES=$(echo "$ALL_NODES" | grep -i 'worker' | paste -d" " -s -)
+    RABBIT_NODES=$(echo "$ALL_NODES" | grep -i 'node'   | grep -v master | paste -d" " -s -)
+    MASTER_NODES=$(echo "$ALL_NODES" | grep -i 'master' | paste -d" " -s -)
 
     ;;
 
 htx2)
+    get_all_nodes
     # The following commands apply to initializing the current HTX-2 environment
-    WORKER_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'rabbit-compute-5' | paste -d" " -s -)
-    RABBIT_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'rabbit-node-2'    | grep -v master | paste -d" " -s -)
-    MASTER_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'rabbit-compute-4' | paste -d" " -s -)
+    WORKER_NODES=$(echo "$ALL_NODES" | grep -i 'rabbit-compute-5' | paste -d" " -s -)
+    RABBIT_NODES=$(echo "$ALL_NODES" | grep -i 'rabbit-node-2'    | grep -v master | paste -d" " -s -)
+    MASTER_NODES=$(echo "$ALL_NODES" | grep -i 'rabbit-compute-4' | paste -d" " -s -)
 
     ;;
 
 
 craystack)
+    get_all_nodes
     # The following commands apply to initializing the current Craystack-lop environment
-    RABBIT_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'rabbit' | paste -d" " -s -)
-    MASTER_NODES=$(kubectl get nodes --no-headers -o custom-columns=:metadata.name | grep -i 'master' | paste -d" " -s -)
+    RABBIT_NODES=$(echo "$ALL_NODES" | grep -i 'rabbit' | paste -d" " -s -)
+    MASTER_NODES=$(echo "$ALL_NODES" | grep -i 'master' | paste -d" " -s -)
 
     # We are using MASTER_NODES as generic k8s workers.
     WORKER_NODES="$MASTER_NODES"
@@ -73,19 +82,23 @@ echo WORKER_NODES "$WORKER_NODES"
 echo RABBIT_NODES "$RABBIT_NODES"
 echo MASTER_NODES "$MASTER_NODES"
 
-# Label the WORKER_NODES to allow them to handle wlm and nnf-sos
-for NODE in $WORKER_NODES; do
-    # Label them for SLCMs.
-    kubectl label node "$NODE" cray.nnf.manager=true
-    kubectl label node "$NODE" cray.wlm.manager=true
-done
+# Label the WORKER_NODES for the SLCMs to allow them to handle wlm and nnf-sos.
+if [ -n "$WORKER_NODES" ]; then
+    # shellcheck disable=2086
+    kubectl label node $WORKER_NODES cray.nnf.manager=true
+    # shellcheck disable=2086
+    kubectl label node $WORKER_NODES cray.wlm.manager=true
+fi
 
-for NODE in $RABBIT_NODES; do
+if [ -n "$RABBIT_NODES" ]; then
     # Taint the rabbit nodes for the NLCMs, to keep any
     # non-NLCM pods off of them.
-    kubectl taint node "$NODE" cray.nnf.node=true:NoSchedule
+    # shellcheck disable=2086
+    kubectl taint node $RABBIT_NODES cray.nnf.node=true:NoSchedule
+fi
 
-    # Label the rabbit nodes for the NLCMs.
+for NODE in $RABBIT_NODES; do
+    # Label the rabbit nodes for the NLCMs. The x-name differs per node.
     kubectl label node "$NODE" cray.nnf.node=true
     kubectl label node "$NODE" cray.nnf.x-name="$NODE"
 done
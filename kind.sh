@@ -70,7 +70,7 @@ EOF
     kubectl taint nodes $NODES cray.nnf.node=true:NoSchedule
 
     # Label the kind-workers as rabbit nodes for the NLCMs.
-    for NODE in $(kubectl get nodes --no-headers | grep --invert-match "control-plane" | awk '{print $1}'); do
+    for NODE in $NODES; do
         kubectl label node "$NODE" cray.nnf.node=true
         kubectl label node "$NODE" cray.nnf.x-name="$NODE"
     done
@@ -90,7 +90,21 @@ if [[ "$CMD" == reset ]]; then
 fi
 
 if [[ "$CMD" == push ]]; then
+  # Each submodule loads its own images, so push them into the cluster concurrently.
+  # Prefix each line of output with its submodule so a failure can be traced, and
+  # fail if any of the pushes fail.
+  PIDS=""
   for SUBMODULE in $SUBMODULES; do
-    (cd $SUBMODULE && make kind-push)
+    (
+      set -o pipefail
+      (cd "$SUBMODULE" && make kind-push) 2>&1 | sed "s|^|[$SUBMODULE] |"
+    ) &
+    PIDS="$PIDS $!"
   done
+
+  RC=0
+  for PID in $PIDS; do
+    wait "$PID" || RC=1
+  done
+  exit $RC
 fi
@@ -20,19 +20,19 @@
 package main
 
 import (
-	"bufio"
 	"bytes"
+	"crypto/md5"
 	"encoding/json"
 	"errors"
 	"fmt"
+	"io"
+	"net/url"
 	"os"
 	"os/exec"
 	"path"
 	"strings"
-	"time"
 
 	"github.com/alecthomas/kong"
-	"gopkg.in/yaml.v2"
 
 	dwsv1alpha1 "github.com/HewlettPackard/dws/api/v1alpha1"
 	"github.com/NearNodeFlash/nnf-deploy/config"
@@ -54,7 +54,7 @@ type Context struct {
 }
 
 var cli struct {
-	Debug  bool `help:"Enable debug mode."`
+	Debug  bool `help:"Enable debug mode; show command output as it runs."`
 	DryRun bool `help:"Show what would be run."`
 
 	Deploy   DeployCmd   `cmd:"" help:"Deploy to current context."`
@@ -82,11 +82,7 @@ func (cmd *DeployCmd) Run(ctx *Context) error {
 		return err
 	}
 
-	err = runInModules(modules, func(module string) error {
-
-		if shouldSkipModule(module, cmd.Only) {
-			return nil
-		}
+	err = runInModules(filterModules(modules, cmd.Only), func(module string) error {
 
 		if err := deployModule(ctx, system, module); err != nil {
 			return err
@@ -117,11 +113,7 @@ func (cmd *UndeployCmd) Run(ctx *Context) error {
 		reversed[i] = modules[len(modules)-i-1]
 	}
 
-	return runInModules(reversed, func(module string) error {
-
-		if shouldSkipModule(module, cmd.Only) {
-			return nil
-		}
+	return runInModules(filterModules(reversed, cmd.Only), func(module string) error {
 
 		if err := deleteSystemConfigFromSOS(ctx, system, module); err != nil {
 			return err
@@ -159,11 +151,7 @@ func (cmd *MakeCmd) Run(ctx *Context) error {
 		return err
 	}
 
-	return runInModules(modules, func(module string) error {
-
-		if shouldSkipModule(module, cmd.Only) {
-			return nil
-		}
+	return runInModules(filterModules(modules, cmd.Only), func(module string) error {
 
 		fmt.Printf("Running Make %s in %s...\n", cmd.Command, module)
 
@@ -194,18 +182,13 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 
 	ctx.Force = cmd.Force
 
-	shouldSkipNode := func(node string) bool {
-		if len(cmd.Nodes) == 0 {
-			return false
-		}
-
-		for _, n := range cmd.Nodes {
-			if n == node {
-				return false
-			}
-		}
+	permittedNodes := make(map[string]bool, len(cmd.Nodes))
+	for _, node := range cmd.Nodes {
+		permittedNodes[node] = true
+	}
 
-		return true
+	shouldSkipNode := func(node string) bool {
+		return len(permittedNodes) != 0 && !permittedNodes[node]
 	}
 
 	system, err := loadSystem()
@@ -218,10 +201,32 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 		return err
 	}
 
-	clusterConfig = strings.TrimPrefix(clusterConfig, "https://")
+	// Like kubectl, accept a server without a scheme (e.g. 10.0.0.1:6443) and assume https.
+	server, err := url.Parse(clusterConfig)
+	if err != nil || server.Scheme == "" || server.Host == "" {
+		server, err = url.Parse("https://" + clusterConfig)
+		if err != nil {
+			return err
+		}
+	}
+
+	k8sServerHost := server.Hostname()
+	if k8sServerHost == "" {
+		return fmt.Errorf("Cluster server '%s' is missing a host", clusterConfig)
+	}
 
-	k8sServerHost := clusterConfig[:strings.Index(clusterConfig, ":")]
-	k8sServerPort := clusterConfig[strings.Index(clusterConfig, ":")+1:]
+	// A server without an explicit port uses the default for its scheme.
+	k8sServerPort := server.Port()
+	if k8sServerPort == "" {
+		switch server.Scheme {
+		case "https":
+			k8sServerPort = "443"
+		case "http":
+			k8sServerPort = "80"
+		default:
+			return fmt.Errorf("Cluster server '%s' is missing a port", clusterConfig)
+		}
+	}
 
 	return config.EnumerateDaemons(func(d config.Daemon) error {
 
@@ -231,27 +236,48 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 			fmt.Printf("Loading Service Account Cert & Token\n")
 
 			fmt.Print("  Secret...")
-			cmd := exec.Command("bash", "-c", fmt.Sprintf("kubectl get serviceaccount %s -n %s -o json | jq -Mr '.secrets[].name | select(contains(\"token\"))'", d.ServiceAccount.Name, d.ServiceAccount.Namespace))
-			secret, err := cmd.CombinedOutput()
+			cmd := exec.Command("kubectl", "get", "serviceaccount", d.ServiceAccount.Name, "-n", d.ServiceAccount.Namespace, "-o", "jsonpath={.secrets[*].name}")
+			secrets, err := cmd.CombinedOutput()
 			if err != nil {
-				fmt.Printf("Failed to load Secret. Output: %s\n", secret)
+				fmt.Printf("Failed to load Secret. Output: %s\n", secrets)
 				return err
 			}
-			secret = secret[:len(secret)-1]
+
+			secret := ""
+			for _, name := range strings.Fields(string(secrets)) {
+				if strings.Contains(name, "token") {
+					secret = name
+					break
+				}
+			}
+			if len(secret) == 0 {
+				return fmt.Errorf("Token secret for service account '%s' not found", d.ServiceAccount.Name)
+			}
 			fmt.Printf("Loaded %s\n", secret)
 
-			fmt.Printf("  Token...")
-			token, err = exec.Command("bash", "-c", fmt.Sprintf("kubectl get secret %s -n %s -o json | jq -Mr '.data.token' | base64 -D", string(secret), d.ServiceAccount.Namespace)).Output()
+			// Fetch the secret once for both the token and the cert; encoding/json decodes
+			// the base64 encoded data into []byte values.
+			fmt.Printf("  Token & Cert...")
+			secretJSON, err := exec.Command("kubectl", "get", "secret", secret, "-n", d.ServiceAccount.Namespace, "-o", "json").Output()
 			if err != nil {
 				return err
 			}
-			fmt.Printf("Loaded REDACTED\n")
 
-			fmt.Printf("  Cert...")
-			cert, err = exec.Command("bash", "-c", fmt.Sprintf("kubectl get secret %s -n %s -o json | jq -Mr '.data[\"ca.crt\"]' | base64 -D", string(secret), d.ServiceAccount.Namespace)).Output()
-			if err != nil {
+			serviceAccountSecret := struct {
+				Data map[string][]byte `json:"data"`
+			}{}
+			if err := json.Unmarshal(secretJSON, &serviceAccountSecret); err != nil {
 				return err
 			}
+
+			token = serviceAccountSecret.Data["token"]
+			if len(token) == 0 {
+				return fmt.Errorf("Token not found in secret '%s'", secret)
+			}
+			cert = serviceAccountSecret.Data["ca.crt"]
+			if len(cert) == 0 {
+				return fmt.Errorf("Cert not found in secret '%s'", secret)
+			}
 			fmt.Printf("Loaded REDACTED\n")
 		}
 
@@ -276,6 +302,67 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 			}
 			fmt.Printf("DONE\n")
 
+			// The binary is the same for every compute node, so checksum it once. Nothing is
+			// compared when updates are forced, so skip reading it in that case.
+			var binaryMD5 []byte
+			var err error
+			if !ctx.Force {
+				if binaryMD5, err = localMD5(ctx, d.Bin); err != nil {
+					return err
+				}
+			}
+
+			// The install locations are the same on every compute node.
+			configDir := "/etc/" + d.Bin
+			overridePath := "/etc/systemd/system/" + d.Bin + ".service.d"
+			serviceTokenFile := path.Join(configDir, "service.token")
+			certFile := path.Join(configDir, "service.cert")
+
+			// Only the node names in the service override differ between compute nodes;
+			// format the rest of it once.
+			execStartPrefix := "[Service]\n" +
+				"ExecStart=\n" +
+				"ExecStart=/usr/bin/" + d.Bin + " \\\n" +
+				"  --kubernetes-service-host=" + k8sServerHost + " \\\n" +
+				"  --kubernetes-service-port=" + k8sServerPort + " \\\n"
+
+			execStartSuffix := ""
+			if len(token) != 0 {
+				execStartSuffix += "  --" + d.ServiceAccount.Token + "=" + serviceTokenFile + " \\\n"
+			}
+			if len(cert) != 0 {
+				execStartSuffix += "  --" + d.ServiceAccount.Cert + "=" + certFile + " \\\n"
+			}
+
+			// The service account token and cert are the same for every compute node, so
+			// stage and checksum them once for the daemon.
+			var tokenMD5, certMD5 []byte
+			if len(token) != 0 {
+				if err := os.WriteFile("service.token", token, 0644); err != nil {
+					return err
+				}
+				defer os.Remove("service.token")
+
+				if !ctx.Force {
+					if tokenMD5, err = localMD5(ctx, "service.token"); err != nil {
+						return err
+					}
+				}
+			}
+
+			if len(cert) != 0 {
+				if err := os.WriteFile("service.cert", cert, 0644); err != nil {
+					return err
+				}
+				defer os.Remove("service.cert")
+
+				if !ctx.Force {
+					if certMD5, err = localMD5(ctx, "service.cert"); err != nil {
+						return err
+					}
+				}
+			}
+
 			fmt.Printf(" Master is %s\n", system.Master)
 			for rabbit := range system.Rabbits {
 				fmt.Printf(" Check clients of rabbit %s\n", rabbit)
@@ -289,22 +376,15 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 
 					fmt.Printf("  Installing %s on Compute Node %s\n", d.Name, compute)
 
-					binaryNeedsUpdate, err := checkNeedsUpdate(ctx, d.Bin, compute, "/usr/bin")
+					binaryNeedsUpdate, err := checkNeedsUpdate(ctx, d.Bin, binaryMD5, compute, "/usr/bin")
 					if err != nil {
 						return err
 					}
 
 					if binaryNeedsUpdate {
 
-						fmt.Printf("  Stopping %s service...", d.Name)
-						cmd := exec.Command("ssh", compute, "systemctl", "stop", d.Bin, "|| true")
-						if _, err := runCommand(ctx, cmd); err != nil {
-							return err
-						}
-						fmt.Printf("\n")
-
-						fmt.Printf("  Removing %s service...", d.Name)
-						cmd = exec.Command("ssh", compute, "/usr/bin/"+d.Bin, "remove", "|| true")
+						fmt.Printf("  Stopping and removing %s service...", d.Name)
+						cmd := exec.Command("ssh", compute, "systemctl", "stop", d.Bin, "|| true;", "/usr/bin/"+d.Bin, "remove", "|| true")
 						if _, err := runCommand(ctx, cmd); err != nil {
 							return err
 						}
@@ -322,83 +402,58 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 						fmt.Printf("\n")
 					}
 
-					configDir := "/etc/" + d.Bin
+					// Create the override directory, and the config directory if there are
+					// service account files to install, in a single ssh session.
+					dirs := []string{overridePath}
 					if len(token) != 0 || len(cert) != 0 {
-						cmd := exec.Command("ssh", compute, "mkdir -p "+configDir)
-						if _, err := runCommand(ctx, cmd); err != nil {
-							return err
-						}
+						dirs = append(dirs, configDir)
+					}
+
+					fmt.Printf("  Creating configuration directories...")
+					cmd := exec.Command("ssh", append([]string{compute, "mkdir", "-p"}, dirs...)...)
+					if _, err := runCommand(ctx, cmd); err != nil {
+						return err
 					}
+					fmt.Printf("\n")
 
-					serviceTokenPath := configDir
 					tokenNeedsUpdate := false
 					if len(token) != 0 {
-						if err := os.WriteFile("service.token", token, 0644); err != nil {
-							return err
-						}
-
-						tokenNeedsUpdate, err = checkNeedsUpdate(ctx, "service.token", compute, serviceTokenPath)
+						tokenNeedsUpdate, err = checkNeedsUpdate(ctx, "service.token", tokenMD5, compute, configDir)
 						if tokenNeedsUpdate {
-							err = copyToNode(ctx, "service.token", compute, serviceTokenPath)
+							err = copyToNode(ctx, "service.token", compute, configDir)
 						}
 
-						os.Remove("service.token")
-
 						if err != nil {
 							return err
 						}
 					}
 
-					certFilePath := configDir
 					certNeedsUpdate := false
 					if len(cert) != 0 {
-						if err := os.WriteFile("service.cert", cert, 0644); err != nil {
-							return err
-						}
-
-						certNeedsUpdate, err = checkNeedsUpdate(ctx, "service.cert", compute, certFilePath)
+						certNeedsUpdate, err = checkNeedsUpdate(ctx, "service.cert", certMD5, compute, configDir)
 						if certNeedsUpdate {
-							err = copyToNode(ctx, "service.cert", compute, certFilePath)
+							err = copyToNode(ctx, "service.cert", compute, configDir)
 						}
 
-						os.Remove("service.cert")
-
 						if err != nil {
 							return err
 						}
 					}
 
-					execStart := ""
-					execStart += "[Service]\n"
-					execStart += "ExecStart=\n"
-					execStart += "ExecStart=/usr/bin/" + d.Bin + " \\\n"
-					execStart += "  --kubernetes-service-host=" + k8sServerHost + " \\\n"
-					execStart += "  --kubernetes-service-port=" + k8sServerPort + " \\\n"
-					execStart += "  --node-name=" + compute + " \\\n"
+					var execStart strings.Builder
+					execStart.WriteString(execStartPrefix)
+					fmt.Fprintf(&execStart, "  --node-name=%s \\\n", compute)
 					if !d.SkipNnfNodeName {
-						execStart += "  --nnf-node-name=" + rabbit + " \\\n"
-					}
-					if len(token) != 0 {
-						execStart += "  --" + d.ServiceAccount.Token + "=" + path.Join(serviceTokenPath, "service.token") + " \\\n"
-					}
-					if len(cert) != 0 {
-						execStart += "  --" + d.ServiceAccount.Cert + "=" + path.Join(certFilePath, "service.cert") + " \\\n"
+						fmt.Fprintf(&execStart, "  --nnf-node-name=%s \\\n", rabbit)
 					}
-
-					fmt.Printf("  Creating override directory...")
-					overridePath := "/etc/systemd/system/" + d.Bin + ".service.d"
-					cmd = exec.Command("ssh", compute, "mkdir", "-p", overridePath)
-					if _, err := runCommand(ctx, cmd); err != nil {
-						return err
-					}
-					fmt.Printf("\n")
+					execStart.WriteString(execStartSuffix)
 
 					fmt.Println("  Creating override configuration...")
-					if err := os.WriteFile("override.conf", []byte(execStart), 0644); err != nil {
+					if err := os.WriteFile("override.conf", []byte(execStart.String()), 0644); err != nil {
 						return err
 					}
 
-					overrideNeedsUpdate, err := checkNeedsUpdate(ctx, "override.conf", compute, overridePath)
+					overrideNeedsUpdate, err := checkNeedsUpdate(ctx, "override.conf", nil, compute, overridePath)
 					if overrideNeedsUpdate {
 						err = copyToNode(ctx, "override.conf", compute, overridePath)
 					}
@@ -410,16 +465,9 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 					}
 
 					if binaryNeedsUpdate || tokenNeedsUpdate || certNeedsUpdate || overrideNeedsUpdate {
-						// Reload the daemon to pick up the override.conf.
-						fmt.Printf("  Reloading service...")
-						cmd = exec.Command("ssh", compute, "systemctl daemon-reload")
-						if _, err := runCommand(ctx, cmd); err != nil {
-							return err
-						}
-						fmt.Printf("\n")
-
-						fmt.Printf("  Starting service...")
-						cmd = exec.Command("ssh", compute, "systemctl", "start", d.Bin)
+						// Reload the daemon to pick up the override.conf, then start the service.
+						fmt.Printf("  Reloading and starting service...")
+						cmd = exec.Command("ssh", compute, "systemctl daemon-reload &&", "systemctl", "start", d.Bin)
 						if _, err := runCommand(ctx, cmd); err != nil {
 							return err
 						}
@@ -435,44 +483,48 @@ func (cmd *InstallCmd) Run(ctx *Context) error {
 	})
 }
 
-type k8scluster struct {
-	Name    string
-	Cluster struct {
-		Server string
-	}
-}
-type k8sConfig struct {
-	Kind     string
-	Clusters []k8scluster
-}
-
+// currentClusterConfig returns the API server address of the cluster used by the
+// current context.
 func currentClusterConfig() (string, error) {
-	current, err := exec.Command("kubectl", "config", "current-context").Output()
+	// Minify the view to the current context so kubectl can select the single server
+	// field for us, rather than decoding the entire kubeconfig here.
+	out, err := exec.Command("kubectl", "config", "view", "--minify", "-o", "jsonpath={.clusters[0].cluster.server}").Output()
 	if err != nil {
 		return "", err
 	}
-	current = current[:len(current)-1]
 
-	configView, err := exec.Command("kubectl", "config", "view").Output()
-	if err != nil {
-		return "", err
+	server := strings.TrimSpace(string(out))
+	if len(server) == 0 {
+		return "", fmt.Errorf("Current Cluster not found")
 	}
 
-	config := new(k8sConfig)
-	if err := yaml.Unmarshal(configView, config); err != nil {
-		return "", err
+	return server, nil
+}
+
+// localMD5 returns the checksum of the local file name in the same format as md5sum,
+// so it can be compared against md5sum output from the compute node.
+func localMD5(ctx *Context, name string) ([]byte, error) {
+	if ctx.DryRun {
+		return nil, nil
 	}
 
-	for _, cluster := range config.Clusters {
-		if cluster.Name == string(current) {
-			return cluster.Cluster.Server, nil
-		}
+	f, err := os.Open(name)
+	if err != nil {
+		return nil, err
 	}
+	defer f.Close()
 
-	return "", fmt.Errorf("Current Cluster %s not found", current)
+	hash := md5.New()
+	if _, err := io.Copy(hash, f); err != nil {
+		return nil, err
+	}
+
+	return []byte(fmt.Sprintf("%x  %s\n", hash.Sum(nil), name)), nil
 }
 
-func checkNeedsUpdate(ctx *Context, name string, compute string, destination string) (bool, error) {
+// checkNeedsUpdate compares the local file name against the copy at destination on
+// the compute node. If src is nil the local checksum is computed on demand.
+func checkNeedsUpdate(ctx *Context, name string, src []byte, compute string, destination string) (bool, error) {
 	fmt.Printf("  Checking Compute Node %s needs update to %s...\n", compute, name)
 
 	if ctx.Force {
@@ -499,9 +551,11 @@ func checkNeedsUpdate(ctx *Context, name string, compute string, destination str
 	}
 
 	fmt.Printf("    Source MD5: ")
-	src, err := runCommand(ctx, exec.Command("md5sum", name))
-	if err != nil {
-		return false, err
+	if src == nil {
+		var err error
+		if src, err = localMD5(ctx, name); err != nil {
+			return false, err
+		}
 	}
 	fmt.Printf("%s", src)
 
@@ -510,7 +564,10 @@ func checkNeedsUpdate(ctx *Context, name string, compute string, destination str
 	if err != nil {
 		return false, err
 	}
-	fmt.Printf("%s", dest)
+	// In debug mode runCommand has already echoed the output as it ran.
+	if !ctx.Debug {
+		fmt.Printf("%s", dest)
+	}
 
 	needsUpdate := !compareMD5(src, dest)
 	if needsUpdate {
@@ -552,14 +609,25 @@ func loadSystem() (*config.System, error) {
 	return system, nil
 }
 
-func currentBranch() (string, error) {
-	out, err := exec.Command("git", "branch", "--show-current").Output()
-	return strings.TrimRight(string(out), "\r\n"), err
-}
+// currentRevision returns the current branch and the last local commit using a single
+// git process. The branch is empty for a detached HEAD.
+func currentRevision() (string, string, error) {
+	out, err := exec.Command("git", "rev-parse", "HEAD", "--abbrev-ref", "HEAD").Output()
+	if err != nil {
+		return "", "", err
+	}
 
-func lastLocalCommit() (string, error) {
-	out, err := exec.Command("git", "rev-parse", "HEAD").Output()
-	return strings.TrimRight(string(out), "\r\n"), err
+	fields := strings.Fields(string(out))
+	if len(fields) != 2 {
+		return "", "", fmt.Errorf("Unexpected git rev-parse output '%s'", out)
+	}
+
+	commit, branch := fields[0], fields[1]
+	if branch == "HEAD" {
+		branch = ""
+	}
+
+	return branch, commit, nil
 }
 
 func getOverlay(system *config.System, module string) (string, error) {
@@ -582,26 +650,6 @@ func getOverlay(system *config.System, module string) (string, error) {
 	return "", nil
 }
 
-func artifactoryVersion(url, commit string) (string, error) {
-	out, err := exec.Command("curl", url).Output()
-	if err != nil {
-		return "", err
-	}
-
-	// Artifactory will return a laundry list of hrefs; try and locate the one with the right commit message
-	scanner := bufio.NewScanner(bytes.NewBuffer(out))
-	for scanner.Scan() {
-		text := scanner.Text()
-		if strings.Contains(text, commit) {
-			start := strings.Index(text, "<a href=\"")
-			end := strings.Index(text, "\">")
-			return text[start+len("<a href=\"") : end-len("\">")+1], nil
-		}
-	}
-
-	return "", fmt.Errorf("Commit %s Not Found", commit)
-}
-
 func deployModule(ctx *Context, system *config.System, module string) error {
 
 	cmd := exec.Command("make", "deploy")
@@ -632,7 +680,7 @@ func deployModule(ctx *Context, system *config.System, module string) error {
 		fmt.Printf(" %s\n", repo.Name)
 
 		fmt.Printf("  Loading Current Branch...")
-		branch, err := currentBranch()
+		branch, commit, err := currentRevision()
 		if err != nil {
 			return err
 		}
@@ -644,21 +692,17 @@ func deployModule(ctx *Context, system *config.System, module string) error {
 		}
 		fmt.Printf(" %s\n", branch)
 
-		url := repo.Master
+		imageURL := repo.Master
 		if branch != "master" {
-			url = repo.Development
+			imageURL = repo.Development
 		}
 
 		fmt.Printf("  Loading Last Commit...")
-		commit, err := lastLocalCommit()
-		if err != nil {
-			return err
-		}
 		fmt.Printf(" %s\n", commit)
 
 		fmt.Print("  Loading From GHCR...")
 		version := commit
-		imageTagBase := strings.TrimSuffix(strings.TrimPrefix(url, "https://"), "/") // According to Tony; docker assumes a secure repo and prepends https when it fetches the image; so we drop it here.
+		imageTagBase := strings.TrimSuffix(strings.TrimPrefix(imageURL, "https://"), "/") // According to Tony; docker assumes a secure repo and prepends https when it fetches the image; so we drop it here.
 
 		cmd.Env = append(os.Environ(),
 			"IMAGE_TAG_BASE="+imageTagBase,
@@ -674,6 +718,10 @@ func deployModule(ctx *Context, system *config.System, module string) error {
 
 func runCommand(ctx *Context, cmd *exec.Cmd) ([]byte, error) {
 	if ctx.DryRun == false {
+		if ctx.Debug {
+			return runCommandStreamed(cmd)
+		}
+
 		if stdoutStderr, err := cmd.CombinedOutput(); err != nil {
 			fmt.Printf("%s\n", stdoutStderr)
 
@@ -690,6 +738,25 @@ func runCommand(ctx *Context, cmd *exec.Cmd) ([]byte, error) {
 	return nil, nil
 }
 
+// runCommandStreamed runs the command with its output echoed as it is produced, rather
+// than held back until the command exits, while keeping a copy for the caller.
+func runCommandStreamed(cmd *exec.Cmd) ([]byte, error) {
+	stdoutStderr := new(bytes.Buffer)
+	cmd.Stdout = io.MultiWriter(os.Stdout, stdoutStderr)
+	cmd.Stderr = cmd.Stdout
+
+	if err := cmd.Run(); err != nil {
+		exitErr := &exec.ExitError{}
+		if errors.As(err, &exitErr) {
+			fmt.Printf("Exit Error: %s (%d)\n", exitErr, exitErr.ExitCode())
+		}
+
+		return stdoutStderr.Bytes(), err
+	}
+
+	return stdoutStderr.Bytes(), nil
+}
+
 func runInModules(modules []string, runFn func(module string) error) error {
 	cwd, err := os.Getwd()
 	if err != nil {
@@ -713,6 +780,19 @@ func runInModules(modules []string, runFn func(module string) error) error {
 	return nil
 }
 
+// filterModules returns, in order, the modules that are not skipped by
+// permittedModulesOrEmpty, so skipped modules are never entered.
+func filterModules(modules []string, permittedModulesOrEmpty []string) []string {
+	filtered := make([]string, 0, len(modules))
+	for _, module := range modules {
+		if !shouldSkipModule(module, permittedModulesOrEmpty) {
+			filtered = append(filtered, module)
+		}
+	}
+
+	return filtered
+}
+
 func shouldSkipModule(module string, permittedModulesOrEmpty []string) bool {
 	if len(permittedModulesOrEmpty) == 0 {
 		return false
@@ -732,28 +812,26 @@ func deleteSystemConfigFromSOS(ctx *Context, system *config.System, module strin
 		return nil
 	}
 
-	// Check if the SystemConfiguration resource exists, and return if it doesn't
-	getCmd := exec.Command("kubectl", "get", "systemconfiguration", "default", "--no-headers")
-	if _, err := runCommand(ctx, getCmd); err != nil {
-		return nil
+	// Check if the SystemConfiguration resource exists, and return if it doesn't. Only
+	// the exit status matters, so leave the output going to /dev/null rather than
+	// capturing it and reporting the expected NotFound as a failure.
+	if !ctx.DryRun {
+		getCmd := exec.Command("kubectl", "get", "systemconfiguration", "default", "--no-headers")
+		if err := getCmd.Run(); err != nil {
+			return nil
+		}
 	}
 
+	// Have kubectl watch until the SystemConfiguration resource is completely gone rather
+	// than polling for it. This may take some time if there are many compute node
+	// namespaces to delete
 	fmt.Println("Deleting SystemConfiguration")
-	deleteCmd := exec.Command("kubectl", "delete", "systemconfiguration", "default")
+	deleteCmd := exec.Command("kubectl", "delete", "systemconfiguration", "default", "--wait=true")
 
 	if _, err := runCommand(ctx, deleteCmd); err != nil {
 		return err
 	}
 
-	// Wait until the SystemConfiguration resource is completely gone. This may take
-	// some time if there are many compute node namespaces to delete
-	for true {
-		if _, err := runCommand(ctx, getCmd); err != nil {
-			break
-		}
-		time.Sleep(1 * time.Second)
-	}
-
 	return nil
 }
 
@@ -797,7 +875,8 @@ func createSystemConfigFromSOS(ctx *Context, system *config.System, module strin
 		return err
 	}
 
-	cmd := exec.Command("bash", "-c", fmt.Sprintf("cat <<EOF | kubectl apply -f - \n%s", configjson))
+	cmd := exec.Command("kubectl", "apply", "-f", "-")
+	cmd.Stdin = bytes.NewReader(configjson)
 	_, err = runCommand(ctx, cmd)
 	return err
 }
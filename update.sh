@@ -19,10 +19,10 @@
 
 source common.sh
 
-for SUBMODULE in $SUBMODULES; do
-    echo Updating submodule "$SUBMODULE"
-    # https://git-scm.com/book/en/v2/Git-Tools-Submodules:
-    # To also initialize, fetch and checkout any nested submodules,
-    # you can use the foolproof git submodule update --init --recursive.
-    git submodule update --init --recursive --remote "$SUBMODULE"
-done
\ No newline at end of file
+echo Updating submodules
+# https://git-scm.com/book/en/v2/Git-Tools-Submodules:
+# To also initialize, fetch and checkout any nested submodules,
+# you can use the foolproof git submodule update --init --recursive.
+# Update every submodule with one git invocation rather than one per submodule.
+# shellcheck disable=2086
+git submodule update --init --recursive --remote $SUBMODULES
\ No newline at end of file